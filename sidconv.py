@@ -19,50 +19,73 @@ Usage:
                                         [--warn-out-of-range]
                                         [--scale-for FACTOR]
                                         [--scale-for-vars T,W,DELAY]
+                                        [--jobs N]
 """
 from __future__ import annotations
 import argparse
+import functools
+import multiprocessing
 import re
-from typing import List, Tuple, Optional, Set
+from typing import FrozenSet, List, Tuple, Optional, Set
 
 # BASIC-friendly variable names; keep letters, avoid symbols for CP/M environments.
 DEFAULT_REG = 212
 DEFAULT_DAT = 213
+# Large I/O buffer so big listings are read and written in few system calls
+IO_BUFFER_SIZE = 1 << 20
+# Lines handed to each worker at a time with --jobs; amortizes the IPC cost per line
+PARALLEL_CHUNKSIZE = 1024
 
 # Simple regexes for parsing
-LINE_NUM_RE = re.compile(r"^\s*(\d+)\s*(.*)$")
 ASSIGN_BASE_RE = re.compile(r"^\s*(?:LET\s+)?([A-Z][A-Z0-9]?)\s*=\s*54272\s*$", re.IGNORECASE)
-POKE_STMT_RE = re.compile(r"^\s*POKE\s+(.+?)\s*,\s*(.+?)\s*$", re.IGNORECASE)
-# FOR..NEXT simple loop recognizer for optional delay scaling
-FOR_RE = re.compile(r"^\s*FOR\s+([A-Z][A-Z0-9]?)\s*=\s*1\s+TO\s*(\d+)\s*$", re.IGNORECASE)
+# Statement shapes we rewrite, in one alternation so each statement enters the regex engine once:
+# POKE addr,val / GET var$ (optional INKEY$ mapping)
+STMT_RE = re.compile(r"^\s*(?:"
+                     r"(?P<poke>POKE\s+(?P<poke_addr>.+?)\s*,\s*(?P<poke_val>.+?))"
+                     r"|(?P<get>GET\s+(?P<get_var>[A-Z][A-Z0-9]?)\$?)"
+                     r")\s*$", re.IGNORECASE)
+# FOR var=1 TO <const> as a whole statement anywhere in a line body, for optional delay scaling
+FOR_SUB_RE = re.compile(r"(^|:)\s*FOR\s+([A-Z][A-Z0-9]?)\s*=\s*1\s+TO\s*(\d+)(?=\s*(?::|$))", re.IGNORECASE)
 NEXT_RE = re.compile(r"^\s*NEXT\s+([A-Z][A-Z0-9]?)\s*$", re.IGNORECASE)
+# POKE address helpers
+_WS_DELETE = str.maketrans('', '', ' \t\r\n\f\v')
 
 
 def split_colon_statements(s: str) -> List[str]:
-    parts = []
-    buf = []
+    # Empty statements between colons are kept; only an empty tail is dropped
+    parts = [p.strip() for p in s.split(':')]
+    if not parts[-1]:
+        parts.pop()
+    return parts
+
+
+def parse_line_num(raw: str) -> Tuple[Optional[int], str]:
+    """Return (line_number, body) or (None, raw) for a line without a leading line number."""
+    # Plain index scan; cheaper than a regex match for every input line
     i = 0
-    while i < len(s):
-        c = s[i]
-        if c == ':':
-            parts.append(''.join(buf).strip())
-            buf = []
-        else:
-            buf.append(c)
+    n = len(raw)
+    while i < n and raw[i].isspace():
         i += 1
-    tail = ''.join(buf).strip()
-    if tail:
-        parts.append(tail)
-    return parts
+    j = i
+    while j < n and '0' <= raw[j] <= '9':
+        j += 1
+    if j == i:
+        return None, raw
+    return int(raw[i:j]), raw[j:].strip()
+
 
+@functools.lru_cache(maxsize=4096)
+def rewrite_poke(arg_addr: str, arg_val: str, base_vars: FrozenSet[str], warn_out_of_range: bool) -> Tuple[Optional[str], Optional[str]]:
+    """Return (out_reg_stmt, out_dat_stmt) or (None, None) if not a SID poke.
 
-def rewrite_poke(arg_addr: str, arg_val: str, base_vars: Set[str], warn_out_of_range: bool) -> Tuple[Optional[str], Optional[str]]:
-    """Return (out_reg_stmt, out_dat_stmt) or (None, None) if not a SID poke."""
+    Memoized, since programs repeat the same POKE shapes (envelopes, note tables);
+    base_vars must therefore be a frozenset.
+    """
     addr_expr = arg_addr.strip()
     val_expr = arg_val.strip()
 
     # Normalize spacing
-    addr_expr_no_sp = re.sub(r"\s+", "", addr_expr)
+    addr_expr_no_sp = addr_expr.translate(_WS_DELETE)
 
     # Match forms:
     # - 54272+X
@@ -76,10 +99,16 @@ def rewrite_poke(arg_addr: str, arg_val: str, base_vars: Set[str], warn_out_of_r
     elif addr_expr_no_sp == "54272":
         offset_expr = "0"
     else:
-        # Variable base
-        m = re.match(r"^([A-Z][A-Z0-9]?)(\+(.+))?$", addr_expr_no_sp, re.IGNORECASE)
-        if m and m.group(1).upper() in base_vars:
-            offset_expr = m.group(3) if m.group(3) is not None else "0"
+        # Variable base; base_vars are already uppercased
+        addr_upper = addr_expr_no_sp.upper()
+        for bv in base_vars:
+            if addr_upper == bv:
+                offset_expr = "0"
+                break
+            n = len(bv) + 1
+            if len(addr_upper) > n and addr_upper.startswith(bv + "+"):
+                offset_expr = addr_expr_no_sp[n:]
+                break
 
     if offset_expr is None:
         return None, None
@@ -87,13 +116,12 @@ def rewrite_poke(arg_addr: str, arg_val: str, base_vars: Set[str], warn_out_of_r
     # Try to detect constant offset to optionally warn about range
     rem = ""
     if warn_out_of_range:
-        try:
+        # Non-constant offsets (variables, expressions) cannot be checked
+        digits = offset_expr[1:] if offset_expr[:1] in ("+", "-") else offset_expr
+        if digits.isdecimal():
             off_eval = int(offset_expr, 10)
             if off_eval < 0 or off_eval > 24:
                 rem = f" : REM WARN: SID reg {off_eval} out of 0-24"
-        except ValueError:
-            # Non-constant; cannot check
-            pass
 
     return f"OUT REG,{offset_expr}", f"OUT DAT,{val_expr}{rem}"
 
@@ -141,14 +169,21 @@ HELPER_FOR_CODE = {
     18:  "COL_RESET$",
 }
 
+# Replacement text keyed by the literal CHR$ argument, so common hits need no int() conversion
+ANSI_STR_MAP = {str(k): f'"{v}"' for k, v in ANSI_CHR_MAP.items()}
+HELPER_STR_MAP = {**ANSI_STR_MAP, **{str(k): v for k, v in HELPER_FOR_CODE.items()}}
+
 CHR_CALL_RE = re.compile(r"CHR\$\(\s*(\d+)\s*\)", re.IGNORECASE)
 
 
 def map_chr_calls_to_profile(stmt: str, screen_profile: str, unknown_policy: str) -> str:
+    # Most statements have no CHR$ at all; skip the regex scan for them
+    if "CHR$" not in stmt.upper():
+        return stmt
     if screen_profile not in ("ansi", "ansi-helpers"):
         # Possibly strip unknown PETSCII
         if unknown_policy == "strip":
-            def strip_repl(m: re.Match) -> str:
+            def strip_repl(m: re.Match[str]) -> str:
                 n = int(m.group(1))
                 # Remove control-range or high-range CHR$ if not printable ASCII
                 if n < 32 or n >= 128:
@@ -157,8 +192,14 @@ def map_chr_calls_to_profile(stmt: str, screen_profile: str, unknown_policy: str
             return CHR_CALL_RE.sub(strip_repl, stmt)
         return stmt
 
-    def repl(m: re.Match) -> str:
-        n = int(m.group(1))
+    replacements = HELPER_STR_MAP if screen_profile == "ansi-helpers" else ANSI_STR_MAP
+
+    def repl(m: re.Match[str]) -> str:
+        hit = replacements.get(m[1])
+        if hit is not None:
+            return hit
+        # Leading zeros or an unmapped code; fall back to the numeric lookup
+        n = int(m[1])
         if screen_profile == "ansi-helpers" and n in HELPER_FOR_CODE:
             return HELPER_FOR_CODE[n]
         if n in ANSI_CHR_MAP:
@@ -173,56 +214,78 @@ def map_chr_calls_to_profile(stmt: str, screen_profile: str, unknown_policy: str
     return CHR_CALL_RE.sub(repl, stmt)
 
 
-def process_line_body(body: str, base_vars: Set[str], warn_out_of_range: bool,
-                      scale_for: Optional[int], scale_for_vars: Set[str],
+@functools.lru_cache(maxsize=2048)
+def process_line_body(body: str, base_vars: FrozenSet[str], warn_out_of_range: bool,
+                      scale_for: Optional[int], scale_for_vars: FrozenSet[str],
                       screen_profile: str, map_get_to_inkey: bool,
                       unknown_policy: str) -> str:
+    """Return the rewritten body of one numbered line.
+
+    Memoized, since programs repeat boilerplate lines (unrolled POKE runs, envelope tables);
+    base_vars and scale_for_vars must therefore be frozensets.
+    """
+    # Optional simple FOR var=1 TO <const> delay scaling, done on the whole body before splitting
+    if scale_for and scale_for > 1 and "FOR" in body.upper():
+        def scale_repl(m: re.Match[str]) -> str:
+            if m[2].upper() not in scale_for_vars:
+                return m[0]
+            return f"{m[1]}FOR {m[2]}=1 TO {int(m[3]) * scale_for}"
+        body = FOR_SUB_RE.sub(scale_repl, body)
+
     # Split by ':' and process each sub-statement
     stmts = split_colon_statements(body)
 
-    # Optional simple FOR..NEXT scaling state machine
-    scaled_stmts = []
-    i = 0
-    while i < len(stmts):
-        s = stmts[i].strip()
-        if scale_for and scale_for > 1:
-            fm = FOR_RE.match(s)
-            if fm and fm.group(1).upper() in scale_for_vars:
-                var = fm.group(1)
-                bound = int(fm.group(2))
-                new_bound = bound * scale_for
-                scaled_stmts.append(f"FOR {var}=1 TO {new_bound}")
-                i += 1
-                continue
-        # Default path
-        scaled_stmts.append(s)
-        i += 1
-
     out_parts: List[str] = []
-    for s in scaled_stmts:
-        # Optional: map GET var$ -> var$=INKEY$
-        if map_get_to_inkey:
-            mg = re.match(r"^\s*GET\s+([A-Z][A-Z0-9]?)\$?\s*$", s, re.IGNORECASE)
-            if mg:
-                var = mg.group(1).upper() + "$"
-                out_parts.append(f"{var}=INKEY$")
+    _stmt_match = STMT_RE.match
+    for s in stmts:
+        m = _stmt_match(s)
+        if m is None:
+            # A known base var assignment becomes <base>=0 on RC2014, keeping the REG/DAT addressing model
+            am = ASSIGN_BASE_RE.match(s)
+            if am and am.group(1).upper() in base_vars:
+                out_parts.append(f"{am.group(1).upper()}=0")
                 continue
-
-        # Try a POKE rewrite
-        pm = POKE_STMT_RE.match(s)
-        if pm:
-            addr, val = pm.group(1), pm.group(2)
-            out_reg, out_dat = rewrite_poke(addr, val, base_vars, warn_out_of_range)
+        elif m.lastgroup == "get" and map_get_to_inkey:
+            # Optional: map GET var$ -> var$=INKEY$
+            var = m.group("get_var").upper() + "$"
+            out_parts.append(f"{var}=INKEY$")
+            continue
+        elif m.lastgroup == "poke":
+            # Try a POKE rewrite; non-SID POKEs fall through unchanged
+            out_reg, out_dat = rewrite_poke(m.group("poke_addr"), m.group("poke_val"),
+                                            base_vars, warn_out_of_range)
             if out_reg and out_dat:
                 out_parts.append(out_reg)
                 out_parts.append(out_dat)
                 continue
+
         # Screen/profile mapping for CHR$ controls
         s2 = map_chr_calls_to_profile(s, screen_profile, unknown_policy)
         out_parts.append(s2)
     return ':'.join(out_parts)
 
 
+def rewrite_line(raw: str, base_vars: FrozenSet[str], warn_out_of_range: bool,
+                 scale_for: Optional[int], scale_for_vars: FrozenSet[str],
+                 screen_profile: str, map_get_to_inkey: bool,
+                 unknown_policy: str) -> Tuple[Optional[int], str]:
+    """Return (line_number, new_body) for one input line.
+
+    new_body is '' when the rewritten body is blank. Unnumbered lines return
+    (None, raw.rstrip()) and are carried through untouched.
+    """
+    ln, body = parse_line_num(raw)
+    if ln is None:
+        # Carry through any non-numbered lines untouched
+        return None, raw.rstrip()
+    new_body = process_line_body(body, base_vars, warn_out_of_range,
+                                 scale_for, scale_for_vars,
+                                 screen_profile, map_get_to_inkey, unknown_policy)
+    if new_body.strip() == '':
+        return ln, ''
+    return ln, new_body
+
+
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Convert C64 BASIC SID POKEs to RC2014 MS BASIC OUTs and improve screen I/O compatibility")
     p.add_argument("input", help="Input .BAS file (C64 BASIC)")
@@ -236,47 +299,52 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--unknown-petscii", choices=["leave","strip","warn"], default="leave", help="How to handle unknown PETSCII CHR$ codes (default leave)")
     p.add_argument("--map-get-to-inkey", action="store_true", help="Replace GET X$ with X$=INKEY$ for keypress handling")
     p.add_argument("--inject-ansi-helpers", action="store_true", help="Insert helper variables (CLS$, HOME$, etc.) in header for use with --screen-profile ansi-helpers")
-    return p.parse_args()
+    p.add_argument("--jobs", type=int, default=1, help="Worker processes for rewriting lines (default 1; 0 uses all CPUs)")
+    args = p.parse_args()
+    if args.jobs < 0:
+        p.error("--jobs must be 0 or a positive number")
+    return args
 
 
-def main():
+def main() -> None:
     args = parse_args()
     scale_for_vars = {v.strip().upper() for v in args.scale_for_vars.split(',') if v.strip()}
 
-    with open(args.input, 'r', encoding='utf-8', errors='ignore') as f:
-        lines = f.read().splitlines()
+    # The base-var prescan needs every line before rewriting starts, so read it in one go
+    with open(args.input, 'r', encoding='utf-8', errors='ignore', buffering=IO_BUFFER_SIZE) as f:
+        source = f.read()
 
-    # First pass: detect base variable names and first line number
-    base_vars: Set[str] = set()
-    first_line_num: Optional[int] = None
-    parsed_lines: List[Tuple[Optional[int], str]] = []
+    lines = source.splitlines()
 
+    # Prescan: base variable names must be known before any POKE is rewritten. Only numbered
+    # lines mentioning 54272 can assign one, so a substring test skips all the others.
+    base_vars: Set[str] = set()
     for raw in lines:
-        m = LINE_NUM_RE.match(raw)
-        if m:
-            ln = int(m.group(1))
-            body = m.group(2).strip()
-            if first_line_num is None:
-                first_line_num = ln
-            # Also scan each colon-separated stmt for base assigns
-            for stmt in split_colon_statements(body):
-                am = ASSIGN_BASE_RE.match(stmt)
-                if am:
-                    base_vars.add(am.group(1).upper())
-            parsed_lines.append((ln, body))
-        else:
-            # Non-numbered line (keep as-is)
-            parsed_lines.append((None, raw.rstrip()))
+        if "54272" not in raw:
+            continue
+        ln, body = parse_line_num(raw)
+        if ln is None:
+            continue
+        for stmt in split_colon_statements(body):
+            am = ASSIGN_BASE_RE.match(stmt)
+            if am:
+                base_vars.add(am.group(1).upper())
 
     # If no explicit base var found, we still translate literal 54272 POKEs
 
+    # The header goes first, so find the first line number up front (normally the very first line)
+    first_line_num: Optional[int] = None
+    for raw in lines:
+        first_line_num, _ = parse_line_num(raw)
+        if first_line_num is not None:
+            break
+
     # Prepare header line number and text
     header_ln: Optional[int] = None
     if first_line_num is not None:
         header_ln = max(0, first_line_num - 5)
     header_text = f"B=0:REG={args.reg}:DAT={args.dat}"
 
-    # Second pass: rewrite
     output_lines: List[str] = []
 
     # Insert header first (numbered if possible)
@@ -312,36 +380,34 @@ def main():
             ln += 1
         insert_base_ln = ln
 
-    for ln, body in parsed_lines:
-        if ln is None:
-            # Carry through any non-numbered lines untouched
-            output_lines.append(body)
-            continue
-        new_body = process_line_body(body, base_vars, args.warn_out_of_range,
-                                      args.scale_for if args.scale_for > 0 else None, scale_for_vars,
-                                      args.screen_profile, args.map_get_to_inkey,
-                                      args.unknown_petscii)
-
-        # If the line contains an assignment of a known base var, rewrite it to BASE=0 on RC2014
-        # This keeps program semantics aligned to REG/DAT addressing model.
-        # Replace only exact "<base>=54272" with "<base>=0" when encountered.
-        replaced = False
-        stmts = split_colon_statements(new_body)
-        for i, s in enumerate(stmts):
-            am = ASSIGN_BASE_RE.match(s)
-            if am and am.group(1).upper() in base_vars:
-                stmts[i] = f"{am.group(1).upper()}=0"
-                replaced = True
-        if replaced:
-            new_body = ':'.join(stmts)
-
-        if new_body.strip() == '':
-            output_lines.append(f"{ln}")
-        else:
-            output_lines.append(f"{ln} {new_body}")
-
-    with open(args.output, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(output_lines) + '\n')
+    scale_for = args.scale_for if args.scale_for > 0 else None
+    rewrite = functools.partial(rewrite_line, base_vars=frozenset(base_vars),
+                                warn_out_of_range=args.warn_out_of_range,
+                                scale_for=scale_for, scale_for_vars=frozenset(scale_for_vars),
+                                screen_profile=args.screen_profile,
+                                map_get_to_inkey=args.map_get_to_inkey,
+                                unknown_policy=args.unknown_petscii)
+
+    # Single pass: rewrite each line and write it straight into the buffered writer, so no
+    # output copy of the program is built in memory. Lines are independent once base_vars is
+    # known, so they can be spread across processes.
+    pool = multiprocessing.Pool(args.jobs or None) if args.jobs != 1 else None
+    try:
+        with open(args.output, 'w', encoding='utf-8', buffering=IO_BUFFER_SIZE) as f:
+            for line in output_lines:
+                f.write(line)
+                f.write('\n')
+            results = pool.imap(rewrite, lines, chunksize=PARALLEL_CHUNKSIZE) if pool else map(rewrite, lines)
+            for line_num, text in results:
+                if line_num is not None:
+                    f.write(str(line_num))
+                    if text:
+                        f.write(' ')
+                f.write(text)
+                f.write('\n')
+    finally:
+        if pool:
+            pool.terminate()
 
 
 if __name__ == "__main__":